@@ -1,4 +1,5 @@
 from .lingua_sdk import Client
+from .lingua_sdk import Delta
 from .lingua_sdk import Model
 
 # SDK metadata
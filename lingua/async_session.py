@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import aiohttp
+import orjson
+
+from .utils import error_message, instance_addr, parse_sse_line
+
+logger = logging.getLogger(__name__)
+
+
+async def check_response(resp):
+    if not resp.ok:
+        raise ValueError(error_message(resp.url, resp.status))
+    logger.debug("addr %s response code %s", resp.url, resp.status)
+
+
+class AsyncGatewaySession:
+    """An asyncio session for issuing concurrent requests to the gateway service"""
+
+    def __init__(
+        self,
+        base_addr: str,
+        auth_key: Optional[str] = None,
+        max_concurrency: int = 16,
+    ):
+        """Initializes the session, which must be entered with ``async with`` before use
+
+        :param base_addr: (str) The base address of the gateway service
+        :param auth_key: (str) The authentication key for the gateway service
+        :param max_concurrency: (int) Maximum number of requests in flight at once
+        """
+        self.base_addr = base_addr
+        self.auth_key = auth_key
+        self.max_concurrency = max_concurrency
+
+        self._http = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        headers = {}
+        if self.auth_key:
+            headers["Authorization"] = f"Bearer {self.auth_key}"
+
+        # Keepalive connections are reused across all requests made in this session,
+        # there is no point opening more of them than requests in flight
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._http = aiohttp.ClientSession(connector=connector, headers=headers)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._http.close()
+
+    async def post(self, addr: str, body: Dict):
+        async with self._semaphore:
+            async with self._http.post(
+                addr,
+                data=orjson.dumps(body),
+                headers={"Content-Type": "application/json"},
+            ) as resp:
+                await check_response(resp)
+                return orjson.loads(await resp.read())
+
+    async def generate(
+        self, model_instance_id: str, prompts: List[str], generation_config: Dict
+    ):
+        """Generates text from the model instance"""
+
+        url = instance_addr(self.base_addr, model_instance_id, "generate")
+        body = {"prompts": prompts, "generation_config": generation_config}
+
+        return await self.post(url, body)
+
+    async def generate_stream(
+        self, model_instance_id: str, prompt: str, generation_config: Dict
+    ):
+        """Yields server-sent events as the model instance generates text"""
+
+        url = instance_addr(self.base_addr, model_instance_id, "generate")
+        body = {"prompts": [prompt], "generation_config": generation_config}
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream, application/json",
+        }
+
+        async with self._semaphore:
+            async with self._http.post(
+                url, data=orjson.dumps(body), headers=headers
+            ) as resp:
+                await check_response(resp)
+
+                if not resp.content_type.startswith("text/event-stream"):
+                    yield orjson.loads(await resp.read())
+                    return
+
+                async for line in resp.content:
+                    event = parse_sse_line(line.decode("utf-8").rstrip("\r\n"))
+                    if event is not None:
+                        yield event
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import orjson
+
+CACHE_MODES = ("on", "off", "read_only", "write_only")
+
+
+def cache_mode(
+    generation_config: Dict, cache_options: Optional[Dict] = None
+) -> Tuple[str, Optional[float]]:
+    """Resolves the cache mode and maximum entry age for a request
+
+    Deterministic requests (temperature 0) are cached by default, everything
+    else is only cached when explicitly enabled through ``cache_options``.
+
+    :param generation_config: (dict) The generation config sent with the request
+    :param cache_options: (dict) Optional ``enabled`` mode and ``max_age_s``
+    """
+    cache_options = cache_options or {}
+    mode = cache_options.get("enabled")
+    if mode is None:
+        mode = "on" if generation_config.get("temperature", 1.0) == 0 else "off"
+    elif mode not in CACHE_MODES:
+        raise ValueError(f"Invalid cache mode {mode}, expected one of {CACHE_MODES}")
+
+    return mode, cache_options.get("max_age_s")
+
+
+class ResponseCache:
+    """An in-memory LRU cache of gateway responses keyed on the request body"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(addr: str, body: Dict) -> str:
+        """Hashes a request into a cache key, independent of the body's key order"""
+        request = orjson.dumps([addr, body], option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(request).hexdigest()
+
+    def get(self, key: str, max_age_s: Optional[float] = None):
+        """Returns the cached response, or None if it is missing or older than max_age_s"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            timestamp, response = entry
+            if max_age_s is not None and time.monotonic() - timestamp > max_age_s:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return response
+
+    def set(self, key: str, response):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+import re
+import tempfile
+import time
+from typing import Callable, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(Path.home() / ".cache" / "lingua")
+
+# Entries older than this are fetched again, in case the model was redeployed
+DEFAULT_MAX_AGE = 24 * 60 * 60
+
+
+def cache_path(path_key: Tuple[str, ...]) -> Path:
+    """Returns the file that caches the response identified by path_key"""
+    name = re.sub(r"[^\w.-]", "_", "-".join(path_key))
+    digest = hashlib.sha256(orjson.dumps(path_key)).hexdigest()[:16]
+    return CACHE_DIR / f"{name}-{digest}.json"
+
+
+def cached_endpoint(
+    path_key: Tuple[str, ...],
+    fetch_fn: Callable,
+    max_age: float = DEFAULT_MAX_AGE,
+):
+    """Returns the response of fetch_fn, persisted on disk across processes
+
+    Entries are not revalidated with the gateway: they are discarded and fetched
+    again once they are older than max_age or were written by another SDK version.
+
+    :param path_key: (tuple) Identifies the endpoint, gateway and model,
+        e.g. ("module_names", "http://llm.cluster.local:3001/", "OPT-175B")
+    :param fetch_fn: (callable) Fetches the response from the gateway
+    :param max_age: (float) Seconds after which an entry is fetched again
+    """
+    from . import __version__
+
+    path = cache_path(path_key)
+
+    try:
+        entry = orjson.loads(path.read_bytes())
+        if (
+            entry["sdk_version"] == __version__
+            and time.time() - entry["cached_at"] < max_age
+        ):
+            return entry["response"]
+        path.unlink()
+    except FileNotFoundError:
+        pass
+    except (OSError, KeyError, TypeError, ValueError):
+        logger.debug("Discarding unreadable cache entry %s", path)
+
+    response = fetch_fn()
+    entry = {"sdk_version": __version__, "cached_at": time.time(), "response": response}
+
+    # Write to a temporary file and rename it so readers never see a partial entry
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(entry))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as err:
+        logger.debug("Could not write cache entry %s: %s", path, err)
+
+    return response
@@ -0,0 +1,27 @@
+import base64
+import json
+import time
+from typing import Optional
+
+
+def token_expiry(jwt: str) -> Optional[float]:
+    """Returns the expiry timestamp encoded in a JWT, or None if it can't be decoded
+
+    The signature is not verified, this is only used to avoid sending tokens
+    that the gateway would reject anyway.
+    """
+    try:
+        payload = jwt.split(".")[1]
+        payload = json.loads(base64.urlsafe_b64decode(payload + "=="))
+        return float(payload["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def token_expired(jwt: str, leeway: float = 30) -> bool:
+    """Checks whether a JWT expires within the next ``leeway`` seconds
+
+    Tokens whose expiry can't be decoded are assumed to be valid.
+    """
+    expiry = token_expiry(jwt)
+    return expiry is not None and time.time() > expiry - leeway
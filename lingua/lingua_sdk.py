@@ -1,19 +1,78 @@
+import asyncio
 from collections import namedtuple
-from functools import cached_property, partial
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
 from getpass import getpass
-import json
-import requests
 from pathlib import Path
 import sys
 import time
-from typing import Dict, List, Optional, Union
-from urllib.parse import urljoin
-
-from .hooks import TestForwardHook
-from .utils import get, post, decode_str
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+from .async_session import AsyncGatewaySession
+from .cache import ResponseCache, cache_mode
+from .diskcache import cached_endpoint
+from .jwt import token_expired
+from .utils import (
+    RateLimiter,
+    clone_activations,
+    copy_response,
+    create_session,
+    decode_response,
+    decode_str,
+    get,
+    instance_addr,
+    post,
+    post_stream,
+)
 
 JWT_TOKEN_FILE = Path(Path.home() / ".lingua.jwt")
 
+# Token read from JWT_TOKEN_FILE, shared by all clients in this process
+_CACHED_JWT = None
+
+
+def _load_jwt():
+    """Returns the cached authentication token, reading it from disk at most once"""
+    global _CACHED_JWT
+    if _CACHED_JWT is None and JWT_TOKEN_FILE.exists():
+        _CACHED_JWT = JWT_TOKEN_FILE.read_text(encoding="utf-8")
+
+    # Drop tokens that are about to expire so the user is asked to log in again
+    if _CACHED_JWT and token_expired(_CACHED_JWT, leeway=60):
+        print("Your authentication token has expired")
+        JWT_TOKEN_FILE.unlink(missing_ok=True)
+        _CACHED_JWT = None
+
+    return _CACHED_JWT
+
+
+def _save_jwt(auth_key: str):
+    global _CACHED_JWT
+    JWT_TOKEN_FILE.write_text(auth_key, encoding="utf-8")
+    _CACHED_JWT = auth_key
+
+
+@lru_cache(maxsize=32)
+def _response_class(typename: str, fields: tuple):
+    """Returns a namedtuple class for a response, created once per set of fields"""
+    return namedtuple(typename, fields)
+
+
+@dataclass
+class Delta:
+    """A chunk of streamed generated text"""
+
+    text: str
+    finish_reason: Optional[str] = None
+
+    @classmethod
+    def from_event(cls, event: Dict):
+        if "generation" in event:
+            # The gateway doesn't stream and returned the full generation instead
+            return cls(text=event["generation"]["text"][0], finish_reason="stop")
+        return cls(text=event.get("text", ""), finish_reason=event.get("finish_reason"))
+
 
 class Client:
     def __init__(
@@ -22,6 +81,8 @@ class Client:
         gateway_port: int,
         auth_key: Optional[str] = None,
         verbose: bool = False,
+        max_connections: int = 32,
+        compress_requests: bool = False,
     ):
         """Initializes the Lingua client which faciliates communication with the gateway service
 
@@ -29,17 +90,25 @@ class Client:
         :param gateway_port: The port of the gateway service
         :param auth_key:  The authentication key for the gateway service
         :param verbose: Print debugging information
+        :param max_connections: Number of connections to the gateway kept alive for reuse
+        :param compress_requests: Compress large request bodies with zstd, the gateway must
+            support zstd encoded requests
         """
 
         if auth_key:
-            self._session = GatewaySession(gateway_host, gateway_port, auth_key)
+            self._session = GatewaySession(
+                gateway_host, gateway_port, auth_key, max_connections, compress_requests
+            )
         else:
-            self._session = GatewaySession(gateway_host, gateway_port)
+            self._session = GatewaySession(
+                gateway_host,
+                gateway_port,
+                max_connections=max_connections,
+                compress_requests=compress_requests,
+            )
 
-            if JWT_TOKEN_FILE.exists():
-                with open(JWT_TOKEN_FILE, "r") as f:
-                    auth_key = f.read()
-            else:
+            auth_key = _load_jwt()
+            if not auth_key:
                 try:
                     print(
                         "You must authenticate with your LDAP credentials to use the Lingua service"
@@ -49,7 +118,7 @@ class Client:
                     print(err)
                     sys.exit(1)
 
-            self._session.auth_key = auth_key
+            self._session.set_auth_key(auth_key)
 
         self.verbose = verbose
         if self.verbose:
@@ -66,12 +135,11 @@ class Client:
             result = self._session.authenticate(username, password)
             if result.status_code == 200:
                 print("Login successful.")
-                auth_key = json.loads(result.text)["token"]
-                with open(JWT_TOKEN_FILE, "w") as f:
-                    f.write(auth_key)
+                auth_key = decode_response(result)["token"]
+                _save_jwt(auth_key)
                 return auth_key
             else:
-                print(f"Authentication failed: {json.loads(result.text)['msg']}")
+                print(f"Authentication failed: {decode_response(result)['msg']}")
                 num_tries += 1
 
         raise Exception("Too many failed login attempts.")
@@ -86,11 +154,14 @@ class Client:
         """Returns a list of available model instances"""
         return self._session.get_model_instances()
 
-    def load_model(self, model_name: str, wait_for_active: bool = False):
+    def load_model(
+        self, model_name: str, wait_for_active: bool = False, timeout: float = 600
+    ):
         """Loads a model from the gateway service
 
         :param model_name: (str) The name of the model to load
         :param wait_for_active: (bool) Whether to wait for the model to become active before returning
+        :param timeout: (float) Seconds to wait for the model to become active before giving up
         """
 
         model_instance_response = self._session.create_model_instance(model_name)
@@ -102,99 +173,246 @@ class Client:
         )
 
         if wait_for_active:
-            active = False
-            while not active:
-                model_state = model.state
-                if model_state == "ACTIVE":
-                    active = True
-                elif model_state == "FAILED":
-                    raise Exception("Model failed to load")
-                time.sleep(2)
+            self._wait_for_active(model, timeout)
 
         return model
 
+    def _wait_for_active(self, model, timeout: float = 600):
+        """Polls the model state with exponential backoff until it becomes active
+
+        :param model: (Model) The model instance to wait on
+        :param timeout: (float) Seconds to wait before raising a TimeoutError
+        """
+        delay = 0.5
+        deadline = time.monotonic() + timeout
+        # The state is always checked once more after the last sleep, so a timeout
+        # of 0 checks it exactly once
+        while True:
+            model_state = model.state
+            if model_state == "ACTIVE":
+                return
+            elif model_state == "FAILED":
+                raise Exception("Model failed to load")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 1.6, 30.0)
+
+        raise TimeoutError(
+            f"Model {model.name} did not become active within {timeout} seconds"
+        )
+
 
 class GatewaySession:
     """A session for a model instance"""
 
+    __slots__ = (
+        "gateway_host",
+        "gateway_port",
+        "max_connections",
+        "compress_threshold",
+        "base_addr",
+        "authenticate_addr",
+        "models_addr",
+        "instances_addr",
+        "_http",
+        "_auth_key",
+        "_cache",
+        "_instances_cache",
+    )
+
     def __init__(
-        self, gateway_host: str, gateway_port: int, auth_key: Optional[str] = None
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        auth_key: Optional[str] = None,
+        max_connections: int = 32,
+        compress_requests: bool = False,
     ):
         self.gateway_host = gateway_host
         self.gateway_port = gateway_port
-        self.auth_key = auth_key
-
+        self.max_connections = max_connections
+        # Request bodies larger than this many bytes are sent zstd compressed
+        self.compress_threshold = 4096 if compress_requests else None
         self.base_addr = f"http://{self.gateway_host}:{self.gateway_port}/"
-        self.create_addr = partial(urljoin, self.base_addr)
+        # Endpoint addresses are built once rather than joined on every request
+        self.authenticate_addr = self.create_addr("authenticate")
+        self.models_addr = self.create_addr("models")
+        self.instances_addr = self.create_addr("models/instances")
+
+        # All requests share one pooled session so connections are kept alive
+        self._http = create_session(max_connections)
+        self.set_auth_key(auth_key)
+
+        self._cache = ResponseCache()
+        # Short-lived (timestamp, response) cache of the model instance listing
+        self._instances_cache = (0.0, None)
+
+    @property
+    def auth_key(self):
+        return self._auth_key
+
+    @auth_key.setter
+    def auth_key(self, auth_key: Optional[str]):
+        self.set_auth_key(auth_key)
+
+    def set_auth_key(self, auth_key: Optional[str]):
+        """Sets the key sent in the Authorization header of every request"""
+        self._auth_key = auth_key
+        if auth_key:
+            self._http.headers["Authorization"] = f"Bearer {auth_key}"
+        else:
+            self._http.headers.pop("Authorization", None)
+
+    def create_addr(self, path: str):
+        return self.base_addr + path
+
+    def instance_addr(self, model_instance_id: str, endpoint: str = ""):
+        return instance_addr(self.base_addr, model_instance_id, endpoint)
 
     def authenticate(self, username: str, password: str):
-        url = self.create_addr("authenticate")
-        response = requests.post(url, auth=(username, password))
+        url = self.authenticate_addr
+        response = self._http.post(url, auth=(username, password))
         return response
 
     def get_models(self):
-        url = self.create_addr("models")
-        response = get(url)
+        url = self.models_addr
+        response = get(url, session=self._http)
         return response
 
-    def get_model_instances(self):
-        url = self.create_addr("models/instances")
-        response = get(url)
+    def get_model_instances(self, max_age: float = 0.5):
+        now = time.monotonic()
+        timestamp, response = self._instances_cache
+        if response is not None and now - timestamp < max_age:
+            return response
+
+        url = self.instances_addr
+        response = get(url, session=self._http)
+        self._instances_cache = (now, response)
         return response
 
     def create_model_instance(self, model_name: str):
-        url = self.create_addr("models/instances")
+        url = self.instances_addr
         body = {"name": model_name}
-        response = post(url, body, auth_key=self.auth_key)
+        response = post(url, body, session=self._http)
 
+        # Instance states are about to change, don't serve them from the cache
+        self._instances_cache = (0.0, None)
         return response
 
     def get_model_instance(self, model_instance_id: str):
-        url = self.create_addr(f"models/instances/{model_instance_id}")
+        url = self.instance_addr(model_instance_id)
 
-        response = get(url, auth_key=self.auth_key)
+        response = get(url, session=self._http)
         return response
 
     def get_model_instance_module_names(self, model_instance_id: str):
-        url = self.create_addr(f"models/instances/{model_instance_id}/module_names")
+        url = self.instance_addr(model_instance_id, "module_names")
+
+        response = get(url, session=self._http)
+        return response
+
+    def _cached_post(
+        self,
+        url: str,
+        body: Dict,
+        cache_options: Optional[Dict],
+        headers: Optional[Dict] = None,
+        copy_fn: Optional[Callable] = None,
+    ):
+        """Posts a request, serving and storing responses according to the cache mode
+
+        copy_fn is applied to responses handed out while the cache is in use, so
+        that callers mutating mutable values (e.g. tensors) can't corrupt the cache.
+        """
+
+        mode, max_age_s = cache_mode(body["generation_config"], cache_options)
+        if mode == "off":
+            return post(
+                url,
+                body,
+                headers=headers,
+                session=self._http,
+                compress_threshold=self.compress_threshold,
+            )
+
+        key = ResponseCache.make_key(url, body)
+        if mode in ("on", "read_only"):
+            response = self._cache.get(key, max_age_s)
+            if response is not None:
+                return copy_fn(response) if copy_fn else response
+
+        response = post(
+            url,
+            body,
+            headers=headers,
+            session=self._http,
+            compress_threshold=self.compress_threshold,
+        )
+        if mode in ("on", "write_only"):
+            self._cache.set(key, response)
+            if copy_fn:
+                response = copy_fn(response)
 
-        response = get(url, auth_key=self.auth_key)
         return response
 
-    def generate(self, model_instance_id: str, prompts: List[str], generation_config: Dict):
+    def generate(
+        self,
+        model_instance_id: str,
+        prompts: List[str],
+        generation_config: Dict,
+        cache_options: Optional[Dict] = None,
+    ):
         """Generates text from the model instance"""
 
-        url = self.create_addr(f"models/instances/{model_instance_id}/generate")
-        body = {"prompts": prompts, 'generation_config': generation_config}
+        url = self.instance_addr(model_instance_id, "generate")
+        body = {"prompts": prompts, "generation_config": generation_config}
 
-        response = post(url, body, auth_key=self.auth_key)
+        response = self._cached_post(url, body, cache_options, copy_fn=copy_response)
 
         return response
 
+    def generate_stream(
+        self, model_instance_id: str, prompt: str, generation_config: Dict
+    ):
+        """Streams generated text from the model instance as server-sent events"""
+
+        url = self.instance_addr(model_instance_id, "generate")
+        body = {"prompts": [prompt], "generation_config": generation_config}
+
+        return post_stream(url, body, session=self._http)
+
     def get_activations(
         self,
         model_instance_id: str,
         prompts: List[str],
         module_names: List[str],
         generation_config: Dict,
+        cache_options: Optional[Dict] = None,
     ):
         """Gets activations from the model instance"""
 
-        url = self.create_addr(
-            f"models/instances/{model_instance_id}/generate_activations"
-        )
+        url = self.instance_addr(model_instance_id, "generate_activations")
         body = {
             "prompts": prompts,
             "module_names": module_names,
             "generation_config": generation_config,
         }
-        
-        response = post(url, body, auth_key=self.auth_key)
+        # Prefer raw tensor bytes, gateways without binary support answer with JSON
+        headers = {"Accept": "application/octet-stream, application/json"}
+
+        response = self._cached_post(
+            url, body, cache_options, headers, copy_fn=clone_activations
+        )
 
         return response
 
 
 class Model:
+    __slots__ = ("name", "id", "_session", "_module_names")
+
     def __init__(
         self, model_instance_id: str, model_name: str, session: GatewaySession
     ):
@@ -207,51 +425,203 @@ class Model:
         self.name = model_name
         self.id = model_instance_id
         self._session = session
+        self._module_names = None
 
     @property
     def state(self):
         """Returns a string describing the state of the model"""
         return self._session.get_model_instance(self.id)["state"]
 
-    @cached_property
+    @property
     def module_names(self):
-        """Returns a list of all module names in this model"""
-        return self._session.get_model_instance_module_names(self.id)["module_names"]
+        """Returns a list of all module names in this model, cached on disk per model"""
+        if self._module_names is None:
+            response = cached_endpoint(
+                ("module_names", self._session.base_addr, self.name),
+                lambda: self._session.get_model_instance_module_names(self.id),
+            )
+            self._module_names = response["module_names"]
+        return self._module_names
 
     def is_active(self):
         """Checks if the model instance is active"""
         return self.state == "ACTIVE"
 
-    def generate(self, prompts: Union[str, List[str]], generation_config: Dict = {}):
-        """ Generates text from the model instance
+    def generate(
+        self,
+        prompts: Union[str, Sequence[str]],
+        generation_config: Dict = {},
+        cache_options: Optional[Dict] = None,
+    ):
+        """Generates text from the model instance
 
-        :param prompts: (str or List[str]) Single prompt or list of prompts to generate from
+        :param prompts: (str or List[str]) Single prompt or list of prompts to generate from.
+            All prompts are sent in a single request so the gateway can batch them together.
         :param kwargs: (dict) Additional arguments to pass to the model
+        :param cache_options: (dict) Client-side cache settings, ``enabled`` is one of
+            "on", "off", "read_only" or "write_only" and ``max_age_s`` bounds the age of
+            reused responses. Requests with temperature 0 are cached by default.
         """
         if isinstance(prompts, str):
             prompts = [prompts]
-        generation_response = self._session.generate(self.id, prompts, generation_config)
-        Generation = namedtuple('Generation', generation_response.keys())
+        else:
+            prompts = list(prompts)
+        generation_response = self._session.generate(
+            self.id, prompts, generation_config, cache_options
+        )
+        Generation = _response_class("Generation", tuple(generation_response))
 
         return Generation(**generation_response)
 
+    def generate_stream(self, prompt: str, generation_config: Dict = {}):
+        """Generates text from the model instance, yielding it as it is produced
+
+        Falls back to yielding the whole generation at once if the gateway
+        doesn't support streaming.
+
+        :param prompt: (str) Prompt to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :return: An iterator of :class:`Delta`
+        """
+        for event in self._session.generate_stream(self.id, prompt, generation_config):
+            yield Delta.from_event(event)
+
+    async def agenerate_stream(self, prompt: str, generation_config: Dict = {}):
+        """Asynchronous version of :meth:`generate_stream`
+
+        :param prompt: (str) Prompt to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :return: An async iterator of :class:`Delta`
+        """
+        async with AsyncGatewaySession(
+            self._session.base_addr, self._session.auth_key
+        ) as session:
+            async for event in session.generate_stream(
+                self.id, prompt, generation_config
+            ):
+                yield Delta.from_event(event)
+
+    def map(
+        self,
+        prompts: Sequence[str],
+        generation_config: Dict = {},
+        max_workers: int = 8,
+        rate_limit: Optional[float] = None,
+    ):
+        """Generates text for each prompt on a pool of threads sharing one connection pool
+
+        Useful with gateways that handle one prompt per request; otherwise prefer
+        passing the whole list to :meth:`generate`.
+
+        :param prompts: (List[str]) List of prompts to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :param max_workers: (int) Number of requests issued concurrently, capped at the
+            client's ``max_connections`` so every worker reuses a pooled connection
+        :param rate_limit: (float) Maximum number of requests issued per second
+        :return: A list with one generation per prompt
+        """
+        max_workers = min(max_workers, self._session.max_connections)
+        limiter = RateLimiter(rate_limit) if rate_limit else None
+
+        def generate_one(prompt):
+            if limiter:
+                limiter.acquire()
+            return self.generate(prompt, generation_config)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(generate_one, prompts))
+
+    async def agenerate(
+        self,
+        prompts: Sequence[str],
+        generation_config: Dict = {},
+        max_concurrency: int = 16,
+        batch_size: int = 1,
+    ):
+        """Generates text concurrently, issuing one request per batch of prompts
+
+        :param prompts: (List[str]) List of prompts to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :param max_concurrency: (int) Maximum number of requests in flight at once
+        :param batch_size: (int) Number of prompts sent in each request, letting the
+            gateway batch them server-side
+        :return: A list with one generation per batch, or the exception raised for that batch
+        """
+        prompts = list(prompts)
+        batches = [
+            prompts[idx : idx + batch_size]
+            for idx in range(0, len(prompts), batch_size)
+        ]
+        async with AsyncGatewaySession(
+            self._session.base_addr, self._session.auth_key, max_concurrency
+        ) as session:
+            tasks = [
+                session.generate(self.id, batch, generation_config) for batch in batches
+            ]
+            responses = await asyncio.gather(*tasks, return_exceptions=True)
+
+        generations = []
+        for response in responses:
+            if isinstance(response, Exception):
+                generations.append(response)
+            else:
+                Generation = _response_class("Generation", tuple(response))
+                generations.append(Generation(**response))
+        return generations
+
+    def generate_batch(
+        self,
+        prompts: Sequence[str],
+        generation_config: Dict = {},
+        max_concurrency: int = 16,
+        batch_size: int = 1,
+    ):
+        """Synchronous wrapper around :meth:`agenerate`
+
+        :param prompts: (List[str]) List of prompts to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :param max_concurrency: (int) Maximum number of requests in flight at once
+        :param batch_size: (int) Number of prompts sent in each request
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(
+                self.agenerate(prompts, generation_config, max_concurrency, batch_size)
+            )
+        raise RuntimeError(
+            "generate_batch cannot be called from a running event loop, use agenerate instead"
+        )
+
     def get_activations(
-        self, prompts: Union[str, List[str]], module_names: List[str], generation_config: Dict = {}
+        self,
+        prompts: Union[str, List[str]],
+        module_names: List[str],
+        generation_config: Dict = {},
+        cache_options: Optional[Dict] = None,
     ):
-        """ Gets activations from the model instance
+        """Gets activations from the model instance
         :param prompts: (str or List[str]) Single prompt or list of prompts to generate from
         :param module_names: (List[str]) The layer to get activations from
+        :param cache_options: (dict) Client-side cache settings, see :meth:`generate`
+        :return: Activations whose ``activations`` field holds one dict of tensors per prompt
         """
         if isinstance(prompts, str):
             prompts = [prompts]
         activations_response = self._session.get_activations(
-            self.id, prompts, module_names, generation_config
+            self.id, prompts, module_names, generation_config, cache_options
         )
-        for idx in range(len(activations_response['activations'])):
-            for elm in activations_response['activations'][idx]:
-                activations_response['activations'][idx][elm] = decode_str(
-                    activations_response['activations'][idx][elm]
-                )
-
-        Activations = namedtuple("Activations", activations_response.keys())
+        # Decode into a copy so that cached responses stay in their encoded form.
+        # Binary responses arrive already decoded into tensors, which the session
+        # clones whenever the cache holds on to them.
+        activations_response = dict(activations_response)
+        activations_response["activations"] = [
+            {
+                elm: decode_str(encoded) if isinstance(encoded, str) else encoded
+                for elm, encoded in activations.items()
+            }
+            for activations in activations_response["activations"]
+        ]
+
+        Activations = _response_class("Activations", tuple(activations_response))
         return Activations(**activations_response)
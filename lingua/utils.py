@@ -2,58 +2,243 @@
 TODOS:
     1. eventually we need to seperate this out to client and server utils
 """
+import io
 import logging
-import json
+import math
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import pickle
 import codecs
+import threading
+import time
+from urllib3.util.retry import Retry
+import zstandard
 
 logger = logging.getLogger(__name__)
 
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def create_session(pool_maxsize=32):
+    """Creates a pooled HTTP session that keeps connections alive between requests
+    and retries transient gateway errors with a short backoff
+
+    :param pool_maxsize: Number of connections kept alive per host, should be at
+        least the number of threads sharing the session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            # Hand the last response to check_response instead of raising RetryError
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Large responses (activations, batched generations) compress well
+    session.headers["Accept-Encoding"] = "zstd, gzip, deflate"
+    return session
+
+
+# Fallback session for calls made without an explicit session
+_default_session = create_session()
+
 
 def decode_str(obj_in_str):
     return pickle.loads(codecs.decode(obj_in_str.encode("utf-8"), "base64"))
 
 
+def decode_tensor_stream(content):
+    """Decodes a binary activations response into a dict of tensors
+
+    The payload starts with an 8 byte little-endian header length, followed by a
+    JSON header and the raw tensor data. The header mirrors the JSON response,
+    except that each activation is described by its dtype, shape and byte offset
+    into the data section.
+    """
+    # Imported lazily since torch is slow to import and only needed here
+    import torch
+
+    header_len = int.from_bytes(content[:8], "little")
+    header = orjson.loads(content[8 : 8 + header_len])
+    # A single copy of the data section, shared by all tensors and writable
+    data = bytearray(content[8 + header_len :])
+
+    activations = []
+    for prompt_activations in header["activations"]:
+        tensors = {}
+        for module_name, spec in prompt_activations.items():
+            dtype = getattr(torch, spec["dtype"])
+            count = math.prod(spec["shape"])
+            if count == 0:
+                tensors[module_name] = torch.empty(spec["shape"], dtype=dtype)
+                continue
+            tensors[module_name] = torch.frombuffer(
+                data, dtype=dtype, count=count, offset=spec["offset"]
+            ).reshape(spec["shape"])
+        activations.append(tensors)
+
+    header["activations"] = activations
+    return header
+
+
+def parse_sse_line(line):
+    """Returns the JSON payload of a server-sent event ``data:`` line, or None for
+    any other line (comments, event names, keepalives, end of stream)
+    """
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:") :].strip()
+    if not data or data == "[DONE]":
+        return None
+    return orjson.loads(data)
+
+
+def response_content(resp):
+    """Returns the response body, decompressing it if it is zstd encoded
+
+    Older urllib3 versions leave zstd bodies untouched while newer ones decode
+    them, so the frame magic number is checked rather than only the header.
+    """
+    content = resp.content
+    if resp.headers.get("Content-Encoding") == "zstd" and content[:4] == ZSTD_MAGIC:
+        # Servers compressing in chunks send several frames, read all of them
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            io.BytesIO(content), read_across_frames=True
+        )
+        content = reader.read()
+    return content
+
+
+def copy_response(response):
+    """Returns a deep copy of a JSON response"""
+    return orjson.loads(orjson.dumps(response))
+
+
+def clone_activations(response):
+    """Returns a copy of an activations response that shares no tensor memory with it"""
+    activations = [
+        {
+            module_name: value.clone() if hasattr(value, "clone") else value
+            for module_name, value in prompt_activations.items()
+        }
+        for prompt_activations in response["activations"]
+    ]
+    return {**response, "activations": activations}
+
+
+def decode_response(resp):
+    content = response_content(resp)
+    if resp.headers.get("Content-Type", "").startswith("application/octet-stream"):
+        return decode_tensor_stream(content)
+    return orjson.loads(content)
+
+
+def error_message(url, status_code):
+    message = "Request to {} not sucessful, Error Code: {}".format(url, status_code)
+    if status_code == 422:
+        return message + ", please check your auth key"
+    elif status_code == 400:
+        return message + ", please check your request body"
+    return message
+
+
 def check_response(resp):
     if not resp.ok:
-        if resp.status_code == 422:
-            raise ValueError(
-                "Request to {} not sucessful, Error Code: {}, please check your auth key".format(
-                    resp.url, resp.status_code
-                )
-            )
-        elif resp.status_code == 400:
-            raise ValueError(
-                "Request to {} not sucessful, Error Code: {}, please check your request body".format(
-                    resp.url, resp.status_code
-                )
-            )
-        raise ValueError(
-            "Request to {} not sucessful, Error Code: {}".format(
-                resp.url, resp.status_code
-            )
-        )
+        raise ValueError(error_message(resp.url, resp.status_code))
     logger.debug("addr %s response code %s", resp.url, resp.status_code)
 
 
-def get(addr, auth_key=None, headers={}):
+def instance_addr(base_addr, model_instance_id, endpoint=""):
+    """Returns the address of a model instance, or of one of its endpoints"""
+    addr = f"{base_addr}models/instances/{model_instance_id}"
+    return f"{addr}/{endpoint}" if endpoint else addr
+
+
+class RateLimiter:
+    """A thread-safe token bucket limiting how many requests are issued per second"""
 
-    if auth_key:
-        headers["Authorization"] = f"Bearer {auth_key}"
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be issued"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
 
-    resp = requests.get(addr, headers=headers)
+
+def get(addr, headers=None, session=None):
+
+    session = session or _default_session
+    resp = session.get(addr, headers=headers)
     check_response(resp)
 
-    return resp.json()
+    return decode_response(resp)
+
 
+def post(addr, body, headers=None, session=None, compress_threshold=None):
 
-def post(addr, body, auth_key=None, headers={}):
+    headers = {**(headers or {}), "Content-Type": "application/json"}
 
-    if auth_key:
-        headers["Authorization"] = f"Bearer {auth_key}"
+    data = orjson.dumps(body)
+    if compress_threshold is not None and len(data) > compress_threshold:
+        data = zstandard.ZstdCompressor().compress(data)
+        headers["Content-Encoding"] = "zstd"
 
-    resp = requests.post(addr, json=body, headers=headers)
+    session = session or _default_session
+    resp = session.post(addr, data=data, headers=headers)
     check_response(resp)
 
-    return resp.json()
+    return decode_response(resp)
+
+
+def post_stream(addr, body, headers=None, session=None):
+    """Posts a request asking for a server-sent event stream and yields each event
+
+    Gateways that don't support streaming answer with a regular response, which
+    is yielded once in its entirety.
+    """
+
+    headers = {
+        **(headers or {}),
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream, application/json",
+        # Events are decoded line by line as they arrive, which zstd would prevent
+        "Accept-Encoding": "gzip, deflate",
+    }
+
+    session = session or _default_session
+    with session.post(
+        addr, data=orjson.dumps(body), headers=headers, stream=True
+    ) as resp:
+        check_response(resp)
+
+        if not resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+            yield decode_response(resp)
+            return
+
+        # Event streams are always UTF-8, whatever charset requests would guess
+        for line in resp.iter_lines():
+            event = parse_sse_line(line.decode("utf-8"))
+            if event is not None:
+                yield event
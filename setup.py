@@ -17,14 +17,17 @@ setup(
     license="MIT",
     packages=["lingua"],
     install_requires=[
+        "aiohttp==3.8.4",
         "certifi==2022.12.7",
         "charset-normalizer==3.0.1",
         "idna==3.4",
+        "orjson==3.8.7",
         "requests==2.28.2",
         "torch==1.13.1",
         "typing_extensions==4.4.0",
         "urllib3==1.26.14",
         "numpy",
+        "zstandard==0.20.0",
     ],
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -0,0 +1,76 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from urllib.parse import urlparse
+
+import orjson
+import pytest
+
+from lingua.lingua_sdk import GatewaySession
+
+
+class FakeClock:
+    """Stands in for time.monotonic and time.sleep, sleeping advances the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def serve():
+    """Starts local HTTP servers whose requests are answered by ``handle``
+
+    ``handle(request)`` receives the BaseHTTPRequestHandler for each request and
+    writes the response itself. Returns the server's base address.
+    """
+    servers = []
+
+    def start(handle):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                handle(self)
+
+            def do_POST(self):
+                handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def respond(request, body, status=200, headers=None):
+    """Writes a complete response to a request received by a ``serve`` server"""
+    request.send_response(status)
+    for name, value in (headers or {}).items():
+        request.send_header(name, value)
+    request.send_header("Content-Length", str(len(body)))
+    request.end_headers()
+    request.wfile.write(body)
+
+
+def read_json(request):
+    """Reads the JSON body of a request received by a ``serve`` server"""
+    return orjson.loads(request.rfile.read(int(request.headers["Content-Length"])))
+
+
+def gateway_session(addr):
+    """Returns a GatewaySession talking to a ``serve`` server"""
+    host, port = urlparse(addr).netloc.split(":")
+    return GatewaySession(host, int(port), auth_key="test-key")
@@ -0,0 +1,41 @@
+import asyncio
+
+import orjson
+
+from lingua import Model
+
+from .conftest import gateway_session, read_json, respond
+
+
+def generate_handler(request):
+    assert request.headers["Authorization"] == "Bearer test-key"
+    assert request.path == "/models/instances/instance-id/generate"
+    prompts = read_json(request)["prompts"]
+    if "fail" in prompts:
+        respond(request, b"", status=400)
+        return
+    body = {"generation": {"text": [prompt.upper() for prompt in prompts]}}
+    respond(request, orjson.dumps(body), headers={"Content-Type": "application/json"})
+
+
+def test_generate_batch_returns_exceptions_in_place(serve):
+    model = Model("instance-id", "OPT", gateway_session(serve(generate_handler)))
+
+    generations = model.generate_batch(["a", "fail", "b"])
+
+    assert generations[0].generation["text"] == ["A"]
+    assert isinstance(generations[1], ValueError)
+    assert generations[2].generation["text"] == ["B"]
+
+
+def test_agenerate_batches_prompts(serve):
+    model = Model("instance-id", "OPT", gateway_session(serve(generate_handler)))
+
+    generations = asyncio.run(
+        model.agenerate(["a", "b", "c"], max_concurrency=2, batch_size=2)
+    )
+
+    assert [generation.generation["text"] for generation in generations] == [
+        ["A", "B"],
+        ["C"],
+    ]
@@ -0,0 +1,34 @@
+import pytest
+from lingua.cache import ResponseCache, cache_mode
+
+
+def test_cache_key_ignores_body_order():
+    key_a = ResponseCache.make_key("addr", {"prompts": ["a"], "generation_config": {}})
+    key_b = ResponseCache.make_key("addr", {"generation_config": {}, "prompts": ["a"]})
+    assert key_a == key_b
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+
+def test_cache_expires_old_entries():
+    cache = ResponseCache()
+    cache.set("a", 1)
+    assert cache.get("a", max_age_s=60) == 1
+    assert cache.get("a", max_age_s=-1) is None
+
+
+def test_cache_mode():
+    assert cache_mode({"temperature": 0}) == ("on", None)
+    assert cache_mode({}) == ("off", None)
+    assert cache_mode({}, {"enabled": "read_only", "max_age_s": 5}) == ("read_only", 5)
+    with pytest.raises(ValueError):
+        cache_mode({}, {"enabled": "sometimes"})
@@ -0,0 +1,75 @@
+import pytest
+
+import lingua
+from lingua import lingua_sdk
+
+from .conftest import FakeClock
+
+
+class FakeModel:
+    name = "OPT"
+
+    def __init__(self, states):
+        self._states = iter(states)
+
+    @property
+    def state(self):
+        return next(self._states)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(lingua_sdk.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(lingua_sdk.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def client():
+    # _wait_for_active doesn't touch the gateway, so skip authentication
+    return lingua.Client.__new__(lingua.Client)
+
+
+def test_wait_for_active_backs_off(client, clock):
+    model = FakeModel(["PENDING", "PENDING", "PENDING", "ACTIVE"])
+    client._wait_for_active(model)
+    assert clock.sleeps == pytest.approx([0.5, 0.8, 1.28])
+
+
+def test_wait_for_active_caps_delay(client, clock):
+    model = FakeModel(["PENDING"] * 20 + ["ACTIVE"])
+    client._wait_for_active(model, timeout=3600)
+    assert max(clock.sleeps) == 30.0
+
+
+def test_wait_for_active_raises_on_failure(client, clock):
+    with pytest.raises(Exception, match="failed to load"):
+        client._wait_for_active(FakeModel(["PENDING", "FAILED"]))
+
+
+def test_wait_for_active_times_out(client, clock):
+    polls = []
+
+    def pending():
+        polls.append(clock.now)
+        return "PENDING"
+
+    with pytest.raises(TimeoutError):
+        client._wait_for_active(FakeModel(iter(pending, None)), timeout=10)
+    assert clock.now == pytest.approx(10)
+    # The state is checked again once the deadline is reached
+    assert polls[-1] == pytest.approx(10)
+
+
+def test_wait_for_active_checks_after_last_sleep(client, clock):
+    # Sleeps of 0.5, 0.8 and then 0.7 clipped to the deadline before the last poll
+    client._wait_for_active(FakeModel(["PENDING"] * 3 + ["ACTIVE"]), timeout=2)
+    assert clock.sleeps == pytest.approx([0.5, 0.8, 0.7])
+
+
+def test_wait_for_active_zero_timeout_checks_once(client, clock):
+    client._wait_for_active(FakeModel(["ACTIVE"]), timeout=0)
+    with pytest.raises(TimeoutError):
+        client._wait_for_active(FakeModel(["PENDING"]), timeout=0)
+    assert clock.sleeps == []
@@ -0,0 +1,81 @@
+import orjson
+import pytest
+
+import lingua
+from lingua import diskcache
+
+PATH_KEY = ("module_names", "http://localhost:3001/", "OPT-175B")
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {"module_names": ["decoder.layers.0"]}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(diskcache, "CACHE_DIR", tmp_path)
+    return tmp_path
+
+
+def test_cached_endpoint_hit():
+    fetch = Fetcher()
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == fetch()
+    fetch.calls = 0
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == {
+        "module_names": ["decoder.layers.0"]
+    }
+    assert fetch.calls == 0
+
+
+def test_cached_endpoint_keys_on_gateway():
+    fetch = Fetcher()
+    diskcache.cached_endpoint(PATH_KEY, fetch)
+    diskcache.cached_endpoint(("module_names", "http://other:3001/", "OPT-175B"), fetch)
+    assert fetch.calls == 2
+
+
+def test_cached_endpoint_version_mismatch(monkeypatch):
+    fetch = Fetcher()
+    diskcache.cached_endpoint(PATH_KEY, fetch)
+    monkeypatch.setattr(lingua, "__version__", "0.0.0")
+    diskcache.cached_endpoint(PATH_KEY, fetch)
+    assert fetch.calls == 2
+
+    entry = orjson.loads(diskcache.cache_path(PATH_KEY).read_bytes())
+    assert entry["sdk_version"] == "0.0.0"
+
+
+def test_cached_endpoint_expired():
+    fetch = Fetcher()
+    diskcache.cached_endpoint(PATH_KEY, fetch)
+    diskcache.cached_endpoint(PATH_KEY, fetch, max_age=0)
+    assert fetch.calls == 2
+
+
+def test_cached_endpoint_corrupt_file():
+    diskcache.cache_path(PATH_KEY).write_bytes(b"{not json")
+    fetch = Fetcher()
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == {
+        "module_names": ["decoder.layers.0"]
+    }
+    assert fetch.calls == 1
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == fetch()
+
+
+def test_cached_endpoint_write_failure(cache_dir, monkeypatch):
+    # A file in place of the cache directory makes every write fail
+    blocked = cache_dir / "blocked"
+    blocked.write_text("")
+    monkeypatch.setattr(diskcache, "CACHE_DIR", blocked)
+
+    fetch = Fetcher()
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == {
+        "module_names": ["decoder.layers.0"]
+    }
+    assert diskcache.cached_endpoint(PATH_KEY, fetch) == fetch()
+    assert fetch.calls == 3
@@ -0,0 +1,23 @@
+import base64
+import json
+import time
+
+from lingua.jwt import token_expired, token_expiry
+
+
+def make_token(payload):
+    encoded = base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8"))
+    return f"header.{encoded.decode('utf-8').rstrip('=')}.signature"
+
+
+def test_token_expiry():
+    assert token_expiry(make_token({"exp": 1234})) == 1234
+    assert token_expiry(make_token({"sub": "user"})) is None
+    assert token_expiry("not a token") is None
+
+
+def test_token_expired():
+    assert token_expired(make_token({"exp": time.time() - 10}))
+    assert token_expired(make_token({"exp": time.time() + 10}))
+    assert not token_expired(make_token({"exp": time.time() + 3600}))
+    assert not token_expired("not a token")
@@ -1,5 +1,13 @@
+import time
+
 import lingua
+import orjson
 import pytest
+import requests
+import torch
+import zstandard
+
+from .conftest import FakeClock, gateway_session, read_json, respond
 
 # Verifies the posted data is echoed correctly
 def test_post():
@@ -16,3 +24,197 @@ def test_get():
 def test_check_response():
     with pytest.raises(ValueError):
         lingua.utils.get("https://httpbin.org/status/404")
+
+
+def test_decode_tensor_stream():
+    tensor = torch.arange(6, dtype=torch.float16).reshape(2, 3)
+    data = tensor.numpy().tobytes()
+    header = orjson.dumps(
+        {"activations": [{"fc1": {"dtype": "float16", "shape": [2, 3], "offset": 0}}]}
+    )
+    content = len(header).to_bytes(8, "little") + header + data
+
+    response = lingua.utils.decode_tensor_stream(content)
+    assert torch.equal(response["activations"][0]["fc1"], tensor)
+
+
+def test_parse_sse_line():
+    assert lingua.utils.parse_sse_line('data: {"text": "hi"}') == {"text": "hi"}
+    assert lingua.utils.parse_sse_line("data: [DONE]") is None
+    assert lingua.utils.parse_sse_line(": keepalive") is None
+    assert lingua.utils.parse_sse_line("") is None
+
+
+def test_retried_errors_reach_check_response(serve):
+    requests_seen = []
+
+    def handle(request):
+        requests_seen.append(request.path)
+        respond(request, b"", status=503)
+
+    addr = serve(handle)
+    with pytest.raises(ValueError):
+        lingua.utils.get(addr + "models")
+    assert len(requests_seen) == 4
+
+
+def test_rate_limiter_refills_tokens(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(lingua.utils.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(lingua.utils.time, "sleep", clock.sleep)
+    limiter = lingua.utils.RateLimiter(2)
+
+    for _ in range(4):
+        limiter.acquire()
+    assert clock.sleeps == pytest.approx([0.5, 0.5])
+
+    # Idle time refills the bucket, but never beyond its capacity
+    clock.now += 10
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == pytest.approx([0.5, 0.5, 0.5])
+
+
+def test_map_keeps_prompt_order(serve):
+    def handle(request):
+        prompt = read_json(request)["prompts"][0]
+        # Later prompts finish first
+        time.sleep((5 - int(prompt)) * 0.02)
+        body = orjson.dumps({"generation": {"text": [prompt]}})
+        respond(request, body, headers={"Content-Type": "application/json"})
+
+    model = lingua.Model("instance-id", "OPT", gateway_session(serve(handle)))
+    generations = model.map([str(idx) for idx in range(5)], max_workers=5)
+
+    assert [generation.generation["text"][0] for generation in generations] == [
+        "0",
+        "1",
+        "2",
+        "3",
+        "4",
+    ]
+
+
+def test_cached_activations_are_not_shared(serve):
+    tensor = torch.ones(2, dtype=torch.float16)
+    header = orjson.dumps(
+        {"activations": [{"fc1": {"dtype": "float16", "shape": [2], "offset": 0}}]}
+    )
+    content = len(header).to_bytes(8, "little") + header + tensor.numpy().tobytes()
+
+    def handle(request):
+        read_json(request)
+        respond(request, content, headers={"Content-Type": "application/octet-stream"})
+
+    model = lingua.Model("instance-id", "OPT", gateway_session(serve(handle)))
+    config = {"temperature": 0}
+
+    model.get_activations("prompt", ["fc1"], config).activations[0]["fc1"].zero_()
+    model.get_activations("prompt", ["fc1"], config).activations[0]["fc1"].mul_(3)
+    cached = model.get_activations("prompt", ["fc1"], config)
+
+    assert torch.equal(cached.activations[0]["fc1"], tensor)
+
+
+def test_post_stream_decodes_utf8_events(serve):
+    events = [{"text": "héllo"}, {"text": " wörld", "finish_reason": "stop"}]
+
+    def handle(request):
+        read_json(request)
+        body = b"".join(b"data: " + orjson.dumps(event) + b"\n\n" for event in events)
+        respond(
+            request,
+            body + b"data: [DONE]\n\n",
+            headers={"Content-Type": "text/event-stream"},
+        )
+
+    addr = serve(handle)
+    assert list(lingua.utils.post_stream(addr + "generate", {})) == events
+
+    model = lingua.Model("instance-id", "OPT", gateway_session(addr))
+    assert [delta.text for delta in model.generate_stream("prompt")] == [
+        "héllo",
+        " wörld",
+    ]
+
+
+def test_map_caps_workers_at_pool_size(serve, monkeypatch):
+    worker_counts = []
+
+    class RecordingExecutor(lingua.lingua_sdk.ThreadPoolExecutor):
+        def __init__(self, max_workers):
+            worker_counts.append(max_workers)
+            super().__init__(max_workers)
+
+    monkeypatch.setattr(lingua.lingua_sdk, "ThreadPoolExecutor", RecordingExecutor)
+
+    def handle(request):
+        read_json(request)
+        respond(request, b'{"generation": {"text": [""]}}')
+
+    session = gateway_session(serve(handle))
+    session.max_connections = 2
+    lingua.Model("instance-id", "OPT", session).map(["a", "b", "c"], max_workers=8)
+
+    assert worker_counts == [2]
+
+
+def test_decode_response_zstd(serve):
+    body = orjson.dumps({"text": "x" * 1000})
+    compressed = zstandard.ZstdCompressor().compress(body)
+
+    def handle(request):
+        respond(
+            request,
+            compressed,
+            headers={"Content-Type": "application/json", "Content-Encoding": "zstd"},
+        )
+
+    addr = serve(handle)
+    assert lingua.utils.get(addr) == {"text": "x" * 1000}
+
+    # Bodies compressed in chunks span several frames
+    compressed = b"".join(
+        zstandard.ZstdCompressor().compress(chunk) for chunk in (body[:5], body[5:])
+    )
+    assert lingua.utils.get(addr) == {"text": "x" * 1000}
+
+    # Bodies that urllib3 already decompressed are left alone
+    resp = requests.Response()
+    resp._content = body
+    resp.headers["Content-Encoding"] = "zstd"
+    assert lingua.utils.response_content(resp) == body
+
+
+def test_authenticate_decodes_zstd(serve, monkeypatch, tmp_path):
+    def handle(request):
+        body = zstandard.ZstdCompressor().compress(b'{"token": "jwt"}')
+        respond(
+            request,
+            body,
+            headers={"Content-Type": "application/json", "Content-Encoding": "zstd"},
+        )
+
+    monkeypatch.setattr(lingua.lingua_sdk, "JWT_TOKEN_FILE", tmp_path / "lingua.jwt")
+    monkeypatch.setattr("builtins.input", lambda prompt: "user")
+    monkeypatch.setattr(lingua.lingua_sdk, "getpass", lambda: "password")
+
+    client = lingua.Client.__new__(lingua.Client)
+    client._session = gateway_session(serve(handle))
+
+    assert client.authenticate() == "jwt"
+    assert (tmp_path / "lingua.jwt").read_text() == "jwt"
+
+
+def test_cached_generations_are_not_shared(serve):
+    def handle(request):
+        read_json(request)
+        respond(request, b'{"generation": {"text": ["hi"]}}')
+
+    model = lingua.Model("instance-id", "OPT", gateway_session(serve(handle)))
+    config = {"temperature": 0}
+
+    model.generate("prompt", config).generation["text"].append("corrupt")
+    model.generate("prompt", config).generation["text"].append("corrupt")
+
+    assert model.generate("prompt", config).generation["text"] == ["hi"]